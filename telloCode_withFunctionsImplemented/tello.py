@@ -1,12 +1,27 @@
+import os
+import queue
 import socket
+import sys
 import threading
-import time
 import traceback
 
+_CMD_COMMAND = b"command"
+_CMD_TAKEOFF = b"takeoff"
+_CMD_LAND = b"land"
+_CMD_BATTERY = b"battery?"
+_CMD_TIME = b"time?"
+_CMD_SPEED = b"speed?"
+
+_CM_PER_UNIT = {"cm": 1.0, "in": 2.54, "m": 100.0, "ft": 30.48}
+_VALID_UNITS = frozenset(_CM_PER_UNIT)
+_VALID_MOVE_DIRECTIONS = frozenset({"forward", "back", "left", "right", "up", "down"})
+
 class Tello:
 	"""Wrapper to simply interactions with the Ryze Tello drone."""
 
-	def __init__(self, units="cm", local_ip="", local_port=8888, interface_name="no-interface", command_timeout=10.0, tello_ip="192.168.10.1", tello_port=8889):
+	_ROT = {"cw": b"cw", "ccw": b"ccw"}
+
+	def __init__(self, units="cm", local_ip="", local_port=8888, interface_name="no-interface", command_timeout=10.0, tello_ip="192.168.10.1", tello_port=8889, receive_cpu=0):
 		"""Binds to the local IP/port and puts the Tello into command mode.
 
 		Args:
@@ -16,39 +31,78 @@ class Tello:
 			command_timeout (int|float): Number of seconds to wait for a response to a command.
 			tello_ip (str): Tello IP.
 			tello_port (int): Tello port.
+			receive_cpu (int|None): CPU to pin the receive thread to, None to leave it unpinned.
 
 		Raises:
 			RuntimeError: If the Tello rejects the attempt to enter command mode.
 
 		"""
-		if units == "cm" or units == "in" or units == "m" or units == "ft":	
-			self.units = units
-		else:
+		if units not in _VALID_UNITS:
 			raise RuntimeError("Incorrect units, must use 'cm', 'in', 'm', or 'ft' ")
+
+		self.units = units
+		self._to_cm = _CM_PER_UNIT[units]
+		self._from_cm = 1.0 / self._to_cm
 		
-		self.abort_flag = False
 		self.command_timeout = command_timeout
-		self.response = None
+		self.receive_cpu = receive_cpu
+		self._rx_q = queue.Queue(maxsize=64)
+		self._command_lock = threading.Lock()
+		self._closed = threading.Event()
+		self._rx_buf = bytearray(1518)
+		self._rx_mv = memoryview(self._rx_buf)
 		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		# Give the kernel room to hold replies while the receive thread is descheduled,
+		# a dropped reply otherwise costs a full command_timeout.
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+		# Commands are a few bytes, a small send buffer makes a stuck link time out instead of queueing.
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8192)
+		# Commands are tiny and latency sensitive, ask for IPTOS_LOWDELAY.
+		self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, 0x10)
 		
 		self.socket.bind((local_ip, local_port))
 		
 		if interface_name != "no-interface":
 			self.socket.setsockopt(socket.SOL_SOCKET, 25, interface_name.encode(encoding="latin-1"))
 		self.tello_address = (tello_ip, tello_port)
+		# Fix the peer so send/recv skip address handling and packets from other hosts are dropped.
+		self.socket.connect(self.tello_address)
+
+		self.socket.settimeout(0.5)
 
 		self.receive_thread = threading.Thread(target=self._receive_thread)
 		self.receive_thread.daemon=True
 
 		self.receive_thread.start()
 
-		if self.send_command("command") != "ok":
-			raise RuntimeError("Tello rejected attempt to enter command mode")
+		# __exit__ never runs if the constructor raises, release the socket and thread here.
+		try:
+			if self.send_command(_CMD_COMMAND) != "ok":
+				raise RuntimeError("Tello rejected attempt to enter command mode")
+		except Exception:
+			self.close()
+			raise
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_tb):
+		self.close()
+
+	def close(self):
+		"""Stops the receive thread and closes the local socket.
+
+		Safe to call more than once. The receive thread keeps the Tello alive
+		while it runs, so this has to be called explicitly, or the Tello used
+		in a with block.
 
-	def __del__(self):
-		"""Closes the local socket."""
+		"""
 
+		self._closed.set()
 		self.socket.close()
+
+		if self.receive_thread is not threading.current_thread():
+			self.receive_thread.join(timeout=1)
 		
 	def send_command(self, command):
 		"""Sends a command to the Tello and waits for a response.
@@ -57,55 +111,118 @@ class Tello:
 		a RuntimeError exception is raised.
 
 		Args:
-			command (str): Command to send.
+			command (str|bytes): Command to send, bytes are sent as-is.
 
 		Returns:
 			str: Response from Tello.
 
 		Raises:
 			RuntimeError: If no response is received within self.timeout seconds.
+			RuntimeError: If the send buffer stays full for the socket timeout.
 		"""
 
-		self.abort_flag = False
-		timer = threading.Timer(self.command_timeout, self.set_abort_flag)
+		if not isinstance(command, bytes):
+			command = command.encode(encoding="utf-8")
 
-		self.socket.sendto(command.encode(encoding="utf-8"), 0, self.tello_address)
+		with self._command_lock:
+			self._drain_responses()
+			self._send(command)
+			return self._wait_response()
 
-		timer.start()
+	def _send(self, command):
+		"""Sends an encoded command, waiting at most the 0.5 s socket timeout for buffer space.
 
-		while self.response is None:
-			if self.abort_flag is True:
-				raise RuntimeError("No response to command")
+		Raises:
+			RuntimeError: If the send buffer stays full for the socket timeout.
 
-		timer.cancel()
+		"""
 
-		response = self.response.decode(encoding="utf-8")
-		self.response = None
+		try:
+			self.socket.send(command)
+		except socket.timeout:
+			raise RuntimeError("Send timed out, is the Tello link stuck?")
 
-		return response
+	def _drain_responses(self):
+		"""Discards unread responses, e.g. a late reply to a command that timed out."""
 
-	def set_abort_flag(self):
-		"""Sets self.abort_flag to True.
+		while True:
+			try:
+				self._rx_q.get_nowait()
+			except queue.Empty:
+				break
 
-		Used by the timer in Tello.send_command() to indicate that a response
-		timeout has occurred.
+	def _wait_response(self):
+		"""Waits for and pops the oldest unread response from the Tello.
+
+		Returns:
+			str: Response from Tello.
+
+		Raises:
+			RuntimeError: If no response is received within self.command_timeout seconds.
 
 		"""
 
-		self.abort_flag = True
+		# Blocks without holding the GIL until _receive_thread publishes a reply.
+		try:
+			response = self._rx_q.get(timeout=self.command_timeout)
+		except queue.Empty:
+			raise RuntimeError("No response to command")
+
+		return response.decode(encoding="utf-8")
 
 	def _receive_thread(self):
 		"""Listens for responses from the Tello.
 
-		Runs as a thread, sets self.response to whatever the Tello last returned.
+		Runs as a thread, puts each datagram the Tello returns on self._rx_q
+		for Tello._wait_response() to pick up. If nobody is reading and the
+		queue is full, new datagrams are dropped. Datagrams are read into the
+		preallocated self._rx_buf, only the bytes actually received are copied
+		out.
+
+		The socket has a short timeout so the loop can notice Tello.close()
+		without relying on the socket being closed under it.
+
+		On Linux the thread pins itself to self.receive_cpu and asks for a
+		higher priority, both best-effort. Elsewhere both calls would apply to
+		the whole process, so they are skipped.
 
 		"""
-		while True:
+		if sys.platform.startswith("linux"):
+			if self.receive_cpu is not None:
+				try:
+					os.sched_setaffinity(0, {self.receive_cpu})
+				except OSError:
+					pass
+
+			# Needs CAP_SYS_NICE, carry on at the default priority without it.
+			try:
+				os.setpriority(os.PRIO_PROCESS, 0, -5)
+			except OSError:
+				pass
+
+		# Bound to locals, the loop below runs once per datagram and per timeout.
+		sock = self.socket
+		mv = self._rx_mv
+		bufsize = len(mv)
+		closed = self._closed.is_set
+		put_nowait = self._rx_q.put_nowait
+
+		while not closed():
 			try:
-				self.response, ip = self.socket.recvfrom(1518)
-			except Exception:
+				n = sock.recv_into(mv, bufsize)
+			except socket.timeout:
+				continue
+			except ConnectionRefusedError:
+				# ICMP port unreachable for an earlier send, reported on connected sockets.
+				continue
+			except OSError:
 				break
 
+			try:
+				put_nowait(bytes(mv[:n]))
+			except queue.Full:
+				pass
+
 	def flip(self, direction):
 		"""Flips in a direction.
 
@@ -127,14 +244,7 @@ class Tello:
 
 		"""
 
-		battery = self.send_command("battery?")
-
-		try:
-			battery = int(battery)
-		except:
-			pass
-
-		return battery
+		return self._parse_int(self.send_command(_CMD_BATTERY))
 
 	def get_flight_time(self):
 		"""Returns the number of seconds elapsed during flight.
@@ -144,14 +254,7 @@ class Tello:
 
 		"""
 
-		flight_time = self.send_command("time?")
-
-		try:
-			flight_time = int(flight_time)
-		except:
-			pass
-
-		return flight_time
+		return self._parse_int(self.send_command(_CMD_TIME))
 
 	def get_speed(self):
 		"""Returns the current speed.
@@ -161,19 +264,57 @@ class Tello:
 
 		"""
 
-		speed = self.send_command("speed?")
+		return self._parse_speed(self.send_command(_CMD_SPEED))
+
+	def get_status(self):
+		"""Returns the battery, speed and flight time in one go.
+
+		The three queries are sent back-to-back and their responses are
+		collected afterwards, so this costs about one round trip instead of
+		three separate getter calls.
+
+		Returns:
+			dict: "battery", "speed" and "time", as returned by
+				Tello.get_battery(), Tello.get_speed() and Tello.get_flight_time().
+
+		Raises:
+			RuntimeError: If a response is not received within self.command_timeout seconds.
+
+		"""
+
+		with self._command_lock:
+			self._drain_responses()
+			for command in (_CMD_BATTERY, _CMD_SPEED, _CMD_TIME):
+				self._send(command)
+
+			battery = self._wait_response()
+			speed = self._wait_response()
+			flight_time = self._wait_response()
+
+		return {
+			"battery": self._parse_int(battery),
+			"speed": self._parse_speed(speed),
+			"time": self._parse_int(flight_time),
+		}
+
+	def _parse_int(self, response):
+		"""Converts a response to an int, returning it unchanged if that fails."""
+
+		try:
+			return int(response)
+		except:
+			return response
+
+	def _parse_speed(self, response):
+		"""Converts a speed? response from cm/s to self.units, returning it unchanged if that fails."""
 
 		try:
-			speed = float(speed)
-
-			if self.units == "in":
-				speed = round((speed * 2.54), 1)
-			elif self.units == "m":
-				speed = round((speed * 100), 1)
-			elif self.units == "ft":
-				speed = round((speed * 2.54 * 12), 1)
+			speed = float(response)
+
+			if self._from_cm != 1.0:
+				speed = round(speed * self._from_cm, 1)
 		except:
-			pass
+			return response
 
 		return speed
 		
@@ -193,15 +334,8 @@ class Tello:
 
 		"""
 
-		speed = float(speed)
+		speed = round(float(speed) * self._to_cm, 1)
 
-		if self.units == "in":
-			speed = round((speed * 2.54), 1)
-		elif self.units == "m":
-			speed = round((speed * 100), 1)
-		elif self.units == "ft":
-			speed = round((speed * 2.54 * 12), 1)
-				
 		if speed < 1 or speed > 100:
 			raise RuntimeError("Requested speed is out of bounds 0.01 - 1 (%s)" % speed)
 
@@ -216,7 +350,7 @@ class Tello:
 		"""
 		
 		print("Taking off")
-		return self.send_command("takeoff")
+		return self.send_command(_CMD_TAKEOFF)
 
 	def land(self):
 		"""Initiates landing.
@@ -226,7 +360,7 @@ class Tello:
 
 		"""
 
-		return self.send_command("land")
+		return self.send_command(_CMD_LAND)
 
 	def move(self, direction, distance):
 		"""Moves in a direction for a distance.
@@ -245,117 +379,25 @@ class Tello:
 
 		"""
 
-		distance = float(distance)
-		
-		if self.units == "in":
-			distance = round(distance * 2.54)
-		elif self.units == "m":
-			distance = round(distance * 100)
-		elif self.units == "ft":
-			distance = round(distance * 2.54 * 12)
-		
+		distance = round(float(distance) * self._to_cm)
+
 		if distance < 20 or distance > 500:
 			raise RuntimeError("Requested distance is out of bounds 0.2 - 5 (%s)" % distance)
 
-		if direction != "forward" and direction != "back" and direction != "left" and direction != "right" and direction != "up" and direction != "down":
+		if direction not in _VALID_MOVE_DIRECTIONS:
 			raise RuntimeError("%s is not a valid direction" % direction)
 
 		print("Moving %s, %s cm" % (direction, distance))
-		return self.send_command("%s %s" % (direction, distance))
-
-	def move_backward(self, distance):
-		"""Moves backward for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-		distance (int): Distance to move.
-
-		Returns:
-			str: Response from Tello, "ok" or "false".
-
-		"""
-
-		return self.move("back", distance)
-
-	def move_down(self, distance):
-		"""Moves down for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-			distance (int): Distance to move.
-
-		Returns:
-			str: Response from Tello, "ok" or "false".
-
-		"""
-
-		return self.move("down", distance)
-
-	def move_forward(self, distance):
-		"""Moves forward for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-			distance (int): Distance to move.
-
-		Returns:
-			str: Response from Tello, "ok" or "false".
-
-		"""
-		return self.move("forward", distance)
-
-	def move_left(self, distance):
-		"""Moves left for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-			distance (int): Distance to move.
-
-		Returns:
-			str: Response from Tello, "ok" or "false".
-
-		"""
-		return self.move("left", distance)
-
-	def move_right(self, distance):
-		"""Moves right for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-			distance (int): Distance to move.
-		
-		Returns:
-			str: Response from Tello, "ok" or "false".
-
-		"""
-		return self.move("right", distance)
-
-	def move_up(self, distance):
-		"""Moves up for a distance.
-
-		See comments for Tello.move().
-
-		Args:
-			distance (int): Distance to move.
-
-		Returns:
-		str: Response from Tello, "ok" or "false".
-
-		"""
-
-		return self.move("up", distance)
+		return self.send_command(b"%s %d" % (direction.encode(), distance))
 
 	def rotate(self, direction, degrees):
 		"""Rotates clockwise or couter-clockwise.
 
+		Fractional degrees are rounded to the nearest whole degree.
+
 		Args:
 			direction (str): Direction to spin, "cw" or "ccw".
-			degrees (int): Degrees to rotate, 1 to 360.
+			degrees (int|float): Degrees to rotate, 1 to 360.
 
 		Returns:
 			str: Response from Tello, "ok" or "false".
@@ -366,18 +408,18 @@ class Tello:
 
 		"""
 
-		if degrees < 1 or degrees > 360:
-			raise RuntimeError("Requested rotation degrees is out of bounds 1 - 360 (%s)" % degrees)
-        
-		if direction == "cw":
-			print("Rotating %s %s degrees" % (direction, degrees))
-			return self.send_command("cw %s" % degrees)
-		elif direction == "ccw":
-			print("Rotating %s %s degrees" % (direction, degrees))
-			return self.send_command("cww %s" % degrees)
-		else:
+		verb = self._ROT.get(direction)
+		if verb is None:
 			raise RuntimeError("%s is not a valid rotation direction" % direction)
-			
+
+		degrees = round(degrees)
+
+		if not 1 <= degrees <= 360:
+			raise RuntimeError("Requested rotation degrees is out of bounds 1 - 360 (%s)" % degrees)
+
+		print("Rotating %s %s degrees" % (direction, degrees))
+		return self.send_command(b"%s %d" % (verb, degrees))
+
 	def rotate_cw(self, degrees):
 		"""Rotates clockwise a given number of degrees
 		
@@ -419,18 +461,15 @@ class Tello:
 			
 		"""
 	
-		if direction == "cw":
-			print("Spinning cw %s times" % rotations)
-			for i in range(rotations):
-				response = self.send_command("cw 360")
-			return response
-		elif direction == "ccw":
-			print("Spinning ccw %s times" % rotations)
-			for i in range(rotations):
-				response = self.send_command("ccw 360")
-			return response
-		else:
+		verb = self._ROT.get(direction)
+		if verb is None:
 			raise RuntimeError("%s is not a valid rotation direction" % direction)
+
+		command = b"%s 360" % verb
+		print("Spinning %s %s times" % (direction, rotations))
+		for i in range(rotations):
+			response = self.send_command(command)
+		return response
 			
 	def fly_poly(self, sides, distance):
 		"""Flys around the perimeter of a polygon
@@ -442,8 +481,33 @@ class Tello:
 		"""
 		
 		print("Beginning polygon flight, flying %s sides at %s cm per side" % (sides, distance))
+		turn = round(360/sides)
 		for s in range(sides):
 			self.move_forward(distance)
-			time.sleep(0.1)
-			self.rotate('cw', round(360/sides))
-			time.sleep(0.1)
+			self.rotate('cw', turn)
+
+
+def _make_move(name, direction):
+	"""Builds a Tello.move_xx method that moves in a fixed direction."""
+
+	def move_direction(self, distance):
+		return self.move(direction, distance)
+
+	move_direction.__name__ = "move_%s" % name
+	move_direction.__qualname__ = "Tello.move_%s" % name
+	move_direction.__doc__ = """Moves %s for a distance.
+
+		See comments for Tello.move().
+
+		Args:
+			distance (int): Distance to move.
+
+		Returns:
+			str: Response from Tello, "ok" or "false".
+
+		""" % name
+	return move_direction
+
+for _name, _direction in (("forward", "forward"), ("backward", "back"), ("left", "left"), ("right", "right"), ("up", "up"), ("down", "down")):
+	setattr(Tello, "move_%s" % _name, _make_move(_name, _direction))
+del _name, _direction
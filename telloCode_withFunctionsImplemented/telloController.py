@@ -67,19 +67,19 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(thr
 log = logging.getLogger('Drone app')
 log.info('Starting')
 
-t = tello.Tello()
-try:
-	start_battery = t.get_battery()
-	print("Battery percentage: %s" % start_battery)
-	t.takeoff()
-	time.sleep(0.5)
-	t.move_up(100)
-	t.flip("f")
-	t.flip("b")
-	t.rotate_cw(180)
-except Exception as e:
-	log.error(e)
-t.land()
-end_battery = t.get_battery()
-print("Battery percentage: %s" % end_battery)
-print("Battery used for flight %s" % (start_battery - end_battery))
+with tello.Tello() as t:
+	try:
+		start_battery = t.get_battery()
+		print("Battery percentage: %s" % start_battery)
+		t.takeoff()
+		time.sleep(0.5)
+		t.move_up(100)
+		t.flip("f")
+		t.flip("b")
+		t.rotate_cw(180)
+	except Exception as e:
+		log.error(e)
+	t.land()
+	end_battery = t.get_battery()
+	print("Battery percentage: %s" % end_battery)
+	print("Battery used for flight %s" % (start_battery - end_battery))